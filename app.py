@@ -1,10 +1,13 @@
+import hashlib
 import io
 import json
 import os
+import shutil
 import tempfile
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 import streamlit as st
 
@@ -18,25 +21,41 @@ audio_utils.cleanup_old_runs(BASE_RUN_DIR, keep_last=4)
 
 if "results" not in st.session_state:
     st.session_state["results"] = None
+if "content_digests" not in st.session_state:
+    st.session_state["content_digests"] = {}
+
+
+def _copy_upload(uploaded, dest: Path, bufsize: int = 1 << 20) -> None:
+    uploaded.seek(0)
+    with open(dest, "wb") as out:
+        shutil.copyfileobj(uploaded, out, length=bufsize)
 
 
 def _write_upload_to_temp(uploaded_file) -> Path:
     suffix = Path(uploaded_file.name).suffix
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-    tmp.write(uploaded_file.getbuffer())
-    tmp.flush()
-    return Path(tmp.name)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        tmp_path = Path(tmp.name)
+    _copy_upload(uploaded_file, tmp_path)
+    return tmp_path
 
 
 @st.cache_data(show_spinner=False)
-def process_audio(file_bytes: bytes, filename: str, options_json: str) -> Dict[str, object]:
+def _probe_upload(_uploaded, name: str, size: int, head_digest: str) -> Dict[str, str]:
+    tmp_path = _write_upload_to_temp(_uploaded)
+    try:
+        return audio_utils.probe_audio(tmp_path)
+    finally:
+        os.unlink(tmp_path)
+
+
+# `_uploaded` is unhashed; `cache_key` covers content and options.
+@st.cache_resource(show_spinner=False, max_entries=4)
+def process_audio(_uploaded, filename: str, options_json: str, cache_key: str) -> Dict[str, object]:
     options = json.loads(options_json)
-    cache_key = audio_utils.hash_bytes_settings(file_bytes, options)
     run_dir = BASE_RUN_DIR / cache_key
     run_dir.mkdir(parents=True, exist_ok=True)
     input_path = run_dir / filename
-    with open(input_path, "wb") as f:
-        f.write(file_bytes)
+    _copy_upload(_uploaded, input_path)
 
     working_wav = run_dir / "input.wav"
     audio_utils.convert_to_wav(input_path, working_wav)
@@ -51,18 +70,24 @@ def process_audio(file_bytes: bytes, filename: str, options_json: str) -> Dict[s
         residual_suppression=options["residual_suppression"],
     )
 
+    output_format = options["output_format"]
     exports_dir = run_dir / "exports"
     exports_dir.mkdir(exist_ok=True)
-    exports = {}
-    for name, stem_path in sep_result["stems"].items():
-        target = exports_dir / f"{name}.{options['output_format']}"
-        audio_utils.export_audio(stem_path, target, options["output_format"])
-        exports[name] = target
+    exports = {name: exports_dir / f"{name}.{output_format}" for name in sep_result["stems"]}
+    workers = max(1, min(len(exports), os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(audio_utils.export_audio, stem_path, exports[name], output_format)
+            for name, stem_path in sep_result["stems"].items()
+        ]
+        for future in futures:
+            future.result()
 
     zip_path = None
     if len(exports) > 1:
         zip_path = exports_dir / "stems.zip"
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        compression = zipfile.ZIP_STORED if output_format in {"mp3", "flac"} else zipfile.ZIP_DEFLATED
+        with zipfile.ZipFile(zip_path, "w", compression, allowZip64=True, compresslevel=1) as zf:
             for name, path in exports.items():
                 zf.write(path, arcname=path.name)
 
@@ -79,8 +104,13 @@ def process_audio(file_bytes: bytes, filename: str, options_json: str) -> Dict[s
     }
 
 
-def audio_bytes(path: Path) -> bytes:
-    return path.read_bytes()
+# Not streamed: Streamlit 1.32 reads the whole handle into memory.
+def _download_button(label: str, path: Optional[Path], file_name: str) -> None:
+    if path is None:
+        st.download_button(label, data=b"", file_name=file_name, disabled=True)
+        return
+    with open(path, "rb") as f:
+        st.download_button(label, data=f, file_name=file_name)
 
 
 def render_results(results: Dict[str, object]) -> None:
@@ -90,44 +120,35 @@ def render_results(results: Dict[str, object]) -> None:
     with cols[0]:
         st.markdown("**Original**")
         original_preview = results.get("working_wav", results["input_path"])
-        st.audio(audio_bytes(original_preview), format="audio/wav")
+        st.audio(str(original_preview), format="audio/wav")
     with cols[1]:
         st.markdown("**Instrumental**")
         inst = results["exports"].get("instrumental") or results["exports"].get("accompaniment")
         if inst:
-            st.audio(audio_bytes(inst))
+            st.audio(str(inst))
         else:
             st.info("No instrumental available")
     with cols[2]:
         st.markdown("**Vocals**")
         vocals = results["exports"].get("vocals")
         if vocals:
-            st.audio(audio_bytes(vocals))
+            st.audio(str(vocals))
         else:
             st.info("Vocals not generated")
 
     st.markdown("---")
     st.markdown("**Downloads**")
     dl_cols = st.columns(3)
+    output_format = results["options"]["output_format"]
     with dl_cols[0]:
-        inst_path = results["exports"].get("instrumental")
-        st.download_button(
-            "Download Instrumental",
-            data=audio_bytes(inst_path) if inst_path else None,
-            file_name=f"instrumental.{results['options']['output_format']}",
-            disabled=inst_path is None,
+        _download_button(
+            "Download Instrumental", results["exports"].get("instrumental"), f"instrumental.{output_format}"
         )
     with dl_cols[1]:
-        voc_path = results["exports"].get("vocals")
-        st.download_button(
-            "Download Vocals",
-            data=audio_bytes(voc_path) if voc_path else None,
-            file_name=f"vocals.{results['options']['output_format']}",
-            disabled=voc_path is None,
-        )
+        _download_button("Download Vocals", results["exports"].get("vocals"), f"vocals.{output_format}")
     with dl_cols[2]:
         if results["zip"]:
-            st.download_button("Download All Stems (zip)", results["zip"].read_bytes(), file_name="stems.zip")
+            _download_button("Download All Stems (zip)", results["zip"], "stems.zip")
         else:
             st.info("Zip available when multiple stems are generated.")
 
@@ -151,13 +172,11 @@ def main() -> None:
         st.caption("Guidance: keep uploads under ~15 minutes or 150 MB to avoid long processing times.")
         file_info = {}
         if uploaded:
-            tmp_path = _write_upload_to_temp(uploaded)
+            head_digest = hashlib.blake2b(uploaded.getbuffer()[:4096]).hexdigest()
             try:
-                file_info = audio_utils.probe_audio(tmp_path)
+                file_info = _probe_upload(uploaded, uploaded.name, uploaded.size, head_digest)
             except Exception as exc:
                 st.warning(f"Could not read audio metadata: {exc}")
-            finally:
-                os.unlink(tmp_path)
             st.write(
                 f"Size: {uploaded.size / 1e6:.2f} MB, "
                 f"Duration: {file_info.get('duration', 'unknown')} s, "
@@ -210,9 +229,16 @@ def main() -> None:
             "use_gpu": bool(use_gpu),
             "residual_suppression": bool(residual),
         }
+        # Content digest is cached per upload; options only re-derive the cache key.
+        digests = st.session_state["content_digests"]
         try:
+            content_digest = digests.get(uploaded.file_id)
+            if content_digest is None:
+                content_digest = audio_utils.hash_content(uploaded.getbuffer())
+                digests[uploaded.file_id] = content_digest
+            cache_key = audio_utils.cache_key_for(content_digest, options)
             progress.progress(25)
-            result = process_audio(uploaded.getbuffer().tobytes(), uploaded.name, json.dumps(options))
+            result = process_audio(uploaded, uploaded.name, json.dumps(options), cache_key)
             progress.progress(100)
             st.session_state["results"] = result
             st.success("Separation finished.")
@@ -1,5 +1,7 @@
+import functools
 import hashlib
 import json
+import os
 import shutil
 import subprocess
 import tempfile
@@ -9,12 +11,21 @@ from typing import Dict, Optional
 import numpy as np
 import soundfile as sf
 
+PCM_WAV_CODECS = {"pcm_s16le", "pcm_s24le", "pcm_s32le", "pcm_f32le"}
+RESIDUAL_STRENGTH = 0.2
+
+
+@functools.lru_cache(maxsize=1)
+def _probe_ffmpeg_tools() -> None:
+    # lru_cache does not store exceptions, so only a successful probe is cached.
+    for tool in ("ffmpeg", "ffprobe"):
+        subprocess.run([tool, "-version"], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
 
 def check_ffmpeg() -> bool:
     """Return True if ffmpeg is available on PATH."""
     try:
-        subprocess.run(["ffmpeg", "-version"], check=True, capture_output=True)
-        subprocess.run(["ffprobe", "-version"], check=True, capture_output=True)
+        _probe_ffmpeg_tools()
         return True
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
@@ -43,18 +54,58 @@ def probe_audio(path: Path) -> Dict[str, str]:
         "sample_rate": stream.get("sample_rate"),
         "channels": stream.get("channels"),
         "format": fmt.get("format_long_name"),
+        "codec": stream.get("codec_name"),
     }
 
 
+def _run_ffmpeg(cmd, error_prefix: str) -> None:
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        stderr = result.stderr.decode("utf-8", errors="replace").strip()
+        raise RuntimeError(f"{error_prefix}: {stderr}")
+
+
 def convert_to_wav(input_path: Path, output_path: Path, sample_rate: Optional[int] = None) -> None:
     """Transcode input audio to float32 WAV for processing."""
-    args = ["ffmpeg", "-y", "-i", str(input_path), "-vn", "-acodec", "pcm_f32le"]
+    if input_path.suffix.lower() == ".wav" and not sample_rate:
+        try:
+            codec = probe_audio(input_path).get("codec")
+        except (RuntimeError, ValueError):
+            codec = None
+        if codec in PCM_WAV_CODECS:
+            link_or_copy(input_path, output_path)
+            return
+    args = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error"]
+    args += ["-i", str(input_path), "-vn", "-acodec", "pcm_f32le"]
     if sample_rate:
         args += ["-ar", str(sample_rate)]
     args += ["-map_metadata", "-1", str(output_path)]
-    result = subprocess.run(args, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"ffmpeg conversion failed: {result.stderr.strip()}")
+    _run_ffmpeg(args, "ffmpeg conversion failed")
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    """Place src at dst via hardlink, in-kernel copy, or a regular copy."""
+    if dst.exists() and os.path.samefile(src, dst):
+        return
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        with open(src, "rb") as fin, open(dst, "wb") as fout:
+            remaining = os.fstat(fin.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fin.fileno(), fout.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        if remaining == 0:
+            return
+    except (AttributeError, OSError):
+        pass
+    shutil.copyfile(src, dst)
 
 
 def export_audio(input_wav: Path, output_path: Path, fmt: str) -> None:
@@ -62,34 +113,30 @@ def export_audio(input_wav: Path, output_path: Path, fmt: str) -> None:
     fmt = fmt.lower()
     output_path.parent.mkdir(parents=True, exist_ok=True)
     if fmt == "wav":
-        shutil.copyfile(input_wav, output_path)
+        link_or_copy(input_wav, output_path)
         return
+    base = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-i", str(input_wav), "-vn"]
     if fmt == "mp3":
-        cmd = [
-            "ffmpeg",
-            "-y",
-            "-i",
-            str(input_wav),
-            "-vn",
-            "-codec:a",
-            "libmp3lame",
-            "-b:a",
-            "320k",
-            str(output_path),
-        ]
+        cmd = base + ["-codec:a", "libmp3lame", "-b:a", "320k", str(output_path)]
     elif fmt == "flac":
-        cmd = ["ffmpeg", "-y", "-i", str(input_wav), "-vn", "-codec:a", "flac", str(output_path)]
+        cmd = base + ["-codec:a", "flac", str(output_path)]
     else:
         raise ValueError(f"Unsupported format: {fmt}")
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"ffmpeg export failed: {result.stderr.strip()}")
+    _run_ffmpeg(cmd, "ffmpeg export failed")
 
 
-def hash_bytes_settings(file_bytes: bytes, settings: Dict[str, str]) -> str:
-    """Hash file bytes and settings to generate a cache key."""
-    h = hashlib.sha256()
-    h.update(file_bytes)
+def hash_content(data) -> str:
+    """Hash a bytes-like object (e.g. an upload's memoryview) without copying it."""
+    try:
+        from blake3 import blake3  # type: ignore
+    except ImportError:
+        return hashlib.blake2b(data, digest_size=32).hexdigest()
+    return blake3(data, max_threads=blake3.AUTO).hexdigest()
+
+
+def cache_key_for(content_digest: str, settings: Dict[str, str]) -> str:
+    """Combine a content digest and settings into a cache key."""
+    h = hashlib.blake2b(content_digest.encode("utf-8"), digest_size=32)
     h.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
     return h.hexdigest()
 
@@ -98,28 +145,48 @@ def cleanup_old_runs(base_dir: Path, keep_last: int = 3) -> None:
     """Remove older run folders to reclaim disk."""
     if not base_dir.exists():
         return
-    dirs = [p for p in base_dir.iterdir() if p.is_dir()]
-    dirs.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    with os.scandir(base_dir) as it:
+        dirs = [entry for entry in it if entry.is_dir()]
+    dirs.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
     for stale in dirs[keep_last:]:
-        shutil.rmtree(stale, ignore_errors=True)
+        shutil.rmtree(stale.path, ignore_errors=True)
+
+
+def suppress_residuals_inplace(inst: np.ndarray, voc: np.ndarray, strength: float = RESIDUAL_STRENGTH) -> None:
+    """Subtract a portion of vocals from the instrumental in place (also scales voc)."""
+    np.multiply(voc, strength, out=voc)
+    np.subtract(inst, voc, out=inst)
+    np.clip(inst, -1.0, 1.0, out=inst)
 
 
 def suppress_residuals(
-    instrumental_path: Path, vocals_path: Path, output_path: Path, strength: float = 0.2
+    instrumental_path: Path,
+    vocals_path: Path,
+    output_path: Path,
+    strength: float = RESIDUAL_STRENGTH,
+    blocksize: int = 1 << 16,
 ) -> None:
     """
     Apply light residual suppression by subtracting a small portion of vocals
-    from the instrumental stem.
+    from the instrumental stem. Both stems are streamed in blocks of
+    `blocksize` frames so long tracks are never fully loaded into memory.
     """
-    inst_audio, sr = sf.read(instrumental_path, dtype="float32", always_2d=True)
-    voc_audio, _ = sf.read(vocals_path, dtype="float32", always_2d=True)
-    min_len = min(len(inst_audio), len(voc_audio))
-    inst_audio = inst_audio[:min_len]
-    voc_audio = voc_audio[:min_len]
-    cleaned = inst_audio - strength * voc_audio
-    cleaned = np.clip(cleaned, -1.0, 1.0)
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    sf.write(output_path, cleaned, sr, subtype="PCM_16")
+    with sf.SoundFile(instrumental_path) as inst_file, sf.SoundFile(vocals_path) as voc_file:
+        inst_buf = np.empty((blocksize, inst_file.channels), dtype="float32")
+        voc_buf = np.empty((blocksize, voc_file.channels), dtype="float32")
+        with sf.SoundFile(
+            output_path, "w", samplerate=inst_file.samplerate, channels=inst_file.channels, subtype="PCM_16"
+        ) as out_file:
+            while True:
+                inst_block = inst_file.read(blocksize, dtype="float32", always_2d=True, out=inst_buf)
+                voc_block = voc_file.read(blocksize, dtype="float32", always_2d=True, out=voc_buf)
+                frames = min(len(inst_block), len(voc_block))
+                if frames == 0:
+                    break
+                inst_block = inst_block[:frames]
+                suppress_residuals_inplace(inst_block, voc_block[:frames], strength)
+                out_file.write(inst_block)
 
 
 def make_temp_run_dir(base_dir: Path) -> Path:
@@ -1,13 +1,23 @@
+import functools
 import json
 import logging
+import os
+import re
 import shutil
 import subprocess
+import threading
 from pathlib import Path
 from typing import Dict, Optional
 
+import soundfile as sf
+
 import audio_utils
 
+LOG_TAIL_LINES = 40
+_DEMUCS_LOCK = threading.Lock()
+
 
+@functools.lru_cache(maxsize=1)
 def is_cuda_available() -> bool:
     try:
         import torch  # type: ignore
@@ -34,11 +44,80 @@ def _select_model(quality: str) -> str:
     return "htdemucs"
 
 
+def _log_tail(output: bytes, max_lines: int = LOG_TAIL_LINES) -> str:
+    lines = re.split(r"[\r\n]+", output.decode("utf-8", errors="replace").strip())
+    return "\n".join(lines[-max_lines:])
+
+
 def _run_process(cmd) -> str:
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
     if result.returncode != 0:
-        raise RuntimeError(result.stderr.strip() or "Process failed")
-    return (result.stdout or "") + (result.stderr or "")
+        raise RuntimeError(_log_tail(result.stderr) or "Process failed")
+    return _log_tail(result.stderr)
+
+
+@functools.lru_cache(maxsize=2)
+def _load_demucs_model(model: str):
+    from demucs.pretrained import get_model  # type: ignore
+
+    demucs_model = get_model(model)
+    demucs_model.cpu()
+    demucs_model.eval()
+    return demucs_model
+
+
+def _separate_in_process(
+    demucs_model,
+    input_wav: Path,
+    output_dir: Path,
+    model: str,
+    stems_mode: str,
+    device: str,
+    residual_strength: Optional[float] = None,
+) -> Dict[str, Path]:
+    import torch  # type: ignore
+    from demucs.apply import apply_model  # type: ignore
+    from demucs.audio import AudioFile, prevent_clip, save_audio  # type: ignore
+
+    wav = AudioFile(input_wav).read(
+        streams=0, samplerate=demucs_model.samplerate, channels=demucs_model.audio_channels
+    )
+    ref = wav.mean(0)
+    wav -= ref.mean()
+    wav /= ref.std()
+    # The cached model is shared by all sessions and apply_model moves it between devices.
+    with _DEMUCS_LOCK:
+        try:
+            with torch.no_grad():
+                sources = apply_model(demucs_model, wav[None], device=device, split=True, overlap=0.25)[0]
+        finally:
+            if device == "cuda":
+                torch.cuda.empty_cache()
+    sources *= ref.std()
+    sources += ref.mean()
+
+    named = dict(zip(demucs_model.sources, sources))
+    two_stems = stems_mode in {"instrumental", "two_stems"}
+    if two_stems:
+        vocals = named.pop("vocals")
+        named = {"vocals": vocals, "no_vocals": sum(named.values())}
+    stem_dir = output_dir / model / input_wav.stem
+    stem_dir.mkdir(parents=True, exist_ok=True)
+
+    if two_stems and residual_strength is not None:
+        # Rescale like save_audio so loud mixes are scaled, not hard-clipped.
+        vocals = prevent_clip(named["vocals"])
+        instrumental = prevent_clip(named["no_vocals"])
+        vocals_path = stem_dir / "vocals.wav"
+        save_audio(vocals, str(vocals_path), samplerate=demucs_model.samplerate, clip="none")
+        audio_utils.suppress_residuals_inplace(instrumental.numpy(), vocals.numpy(), residual_strength)
+        instrumental_path = stem_dir / "instrumental_clean.wav"
+        sf.write(instrumental_path, instrumental.numpy().T, demucs_model.samplerate, subtype="PCM_16")
+        return {"vocals": vocals_path, "instrumental": instrumental_path}
+
+    for name, source in named.items():
+        save_audio(source, str(stem_dir / f"{name}.wav"), samplerate=demucs_model.samplerate)
+    return _map_demucs_outputs(stem_dir, stems_mode)
 
 
 def run_demucs(
@@ -47,32 +126,56 @@ def run_demucs(
     stems_mode: str,
     quality: str = "balanced",
     use_gpu: bool = True,
+    residual_strength: Optional[float] = None,
 ) -> Dict[str, object]:
     model = _select_model(quality)
-    cmd = [
-        _base_command(),
-        "-m",
-        "demucs.separate",
-        "-n",
-        model,
-        "-o",
-        str(output_dir),
-    ]
-    if stems_mode in {"instrumental", "two_stems"}:
-        cmd += ["--two-stems", "vocals"]
     device = "cuda" if use_gpu and is_cuda_available() else "cpu"
-    cmd += ["-d", device, str(input_wav)]
-    log = _run_process(cmd)
-    stem_dir = _find_stem_dir(output_dir, input_wav.stem)
-    stems = _map_demucs_outputs(stem_dir, stems_mode)
-    return {"stems": stems, "log": log}
+    try:
+        demucs_model = _load_demucs_model(model)
+    except (ImportError, OSError, RuntimeError, SystemExit) as exc:
+        # Load failures only; dora's fatal() raises SystemExit (e.g. missing diffq).
+        demucs_model = None
+        load_error = exc
+    if demucs_model is not None:
+        stems = _separate_in_process(
+            demucs_model, input_wav, output_dir, model, stems_mode, device, residual_strength
+        )
+        log = f"Demucs {model} ran in-process on {device}"
+        residual_suppressed = residual_strength is not None and stems_mode in {"instrumental", "two_stems"}
+    else:
+        cmd = [
+            _base_command(),
+            "-m",
+            "demucs.separate",
+            "-n",
+            model,
+            "-o",
+            str(output_dir),
+        ]
+        if stems_mode in {"instrumental", "two_stems"}:
+            cmd += ["--two-stems", "vocals"]
+        cmd += ["-d", device, str(input_wav)]
+        log = f"In-process Demucs unavailable ({load_error}); using CLI\n" + _run_process(cmd)
+        stem_dir = _find_stem_dir(output_dir, model, input_wav.stem)
+        stems = _map_demucs_outputs(stem_dir, stems_mode)
+        residual_suppressed = False
+    return {"stems": stems, "log": log, "residual_suppressed": residual_suppressed}
 
 
-def _find_stem_dir(output_dir: Path, track_name: str) -> Path:
-    candidates = [p for p in output_dir.rglob(track_name) if p.is_dir()]
-    if not candidates:
-        raise FileNotFoundError("Demucs output not found")
-    return candidates[0]
+def _find_stem_dir(output_dir: Path, model: str, track_name: str) -> Path:
+    candidate = output_dir / model / track_name
+    if candidate.is_dir():
+        return candidate
+    pending = [output_dir] if output_dir.is_dir() else []
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                if entry.name == track_name:
+                    return Path(entry.path)
+                pending.append(Path(entry.path))
+    raise FileNotFoundError("Demucs output not found")
 
 
 def _map_demucs_outputs(stem_dir: Path, stems_mode: str) -> Dict[str, Path]:
@@ -126,9 +229,19 @@ def separate_audio(
     engine = "demucs"
     try:
         log_lines.append(f"Running Demucs ({quality}) on {input_wav.name}")
-        demucs_out = run_demucs(input_wav, demucs_dir, stems_mode, quality, use_gpu)
+        demucs_out = run_demucs(
+            input_wav,
+            demucs_dir,
+            stems_mode,
+            quality,
+            use_gpu,
+            residual_strength=audio_utils.RESIDUAL_STRENGTH if residual_suppression else None,
+        )
         log_lines.append(demucs_out["log"])
         stems = demucs_out["stems"]
+        if demucs_out["residual_suppressed"]:
+            residual_suppression = False
+            log_lines.append("Applied light residual suppression")
     except Exception as demucs_err:
         log_lines.append(f"Demucs failed: {demucs_err}")
         if stems_mode == "four_stems":